@@ -3,6 +3,7 @@
 
 from google.cloud import bigquery
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
 import os
 from pathlib import Path
@@ -13,19 +14,37 @@ PROJECT_ID = os.getenv("BQ_PROJECT")
 DATASET_ID = os.getenv("BQ_DATASET")
 client = bigquery.Client(project=PROJECT_ID)
 
+DOW_NAMES = np.array(["Monday", "Tuesday", "Wednesday", "Thursday",
+                      "Friday", "Saturday", "Sunday"])
+
 #Generate date dimension for 2023-2026
 def populate_dim_date():
-    
+
     dates = pd.date_range(start='2023-01-01', end='2026-12-31', freq='D')
-    
+
+    # Derive every attribute from the underlying days-since-epoch ints in
+    # one numpy pass instead of a separate pandas accessor walk per column
+    arr  = dates.values.astype('datetime64[D]')
+    days = arr.view('i8')
+    dow  = (days + 3) % 7                       # 1970-01-01 was a Thursday; Monday=0
+
+    # ISO week: the Thursday of a date's week pins down its ISO year
+    thursday = ((days - dow + 3).view('datetime64[D]'))
+    iso_jan1 = thursday.astype('datetime64[Y]').astype('datetime64[D]')
+    week_number = (thursday - iso_jan1).view('i8') // 7 + 1
+
+    year    = arr.astype('datetime64[Y]').view('i8') + 1970
+    month   = arr.astype('datetime64[M]').view('i8') % 12 + 1
+    quarter = (month - 1) // 3 + 1
+
     dim_date = pd.DataFrame({
         'date_key': dates,
-        'day_of_week': dates.day_name(),
-        'week_number': dates.isocalendar().week,
-        'month': dates.month,
-        'quarter': dates.quarter,
-        'year': dates.year,
-        'is_weekend': dates.dayofweek.isin([5, 6])
+        'day_of_week': DOW_NAMES[dow],
+        'week_number': week_number,
+        'month': month,
+        'quarter': quarter,
+        'year': year,
+        'is_weekend': dow >= 5
     })
     
     # Load to BigQuery
@@ -46,12 +65,13 @@ def populate_dim_customer():
     print("  → Running transformation to extract customers...")
     orders_df, _, _, _ = run_transformation()
     
-    # Extract unique customers
-    customers = orders_df[orders_df['customer_id'].notna()][['customer_id', 'created_at']].copy()
-    customers = customers.groupby('customer_id').agg({'created_at': 'min'}).reset_index()
-    customers['customer_name'] = None
-    customers['email'] = None
-    customers['country'] = None
+    # Extract unique customers: first-seen timestamp per customer via a
+    # stable sort + dedup, which skips groupby's per-group dispatch
+    mask = orders_df['customer_id'].notna()
+    customers = (orders_df.loc[mask, ['customer_id', 'created_at']]
+                 .sort_values('created_at', kind='stable')
+                 .drop_duplicates('customer_id', keep='first'))
+    customers[['customer_name', 'email', 'country']] = None
     
     if not customers.empty:
         # Load to BigQuery
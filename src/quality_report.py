@@ -1,15 +1,52 @@
+import sys
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 from datetime import datetime, timezone
 from pathlib import Path
-from transformer import fetch_events, normalize_orders, normalize_payments, normalize_refunds
+from transformer import (db, fetch_normalized, normalize_orders,
+                         normalize_payments, normalize_refunds,
+                         ORDER_FIELDS, PAYMENT_FIELDS, REFUND_FIELDS)
+
+SUCCESS_STATUSES = ["success", "successful", "completed", "paid"]
+
+
+def _payload_field(*fields):
+    """Coalesce payload field aliases with a nested $ifNull chain."""
+    expr = f"$payload.{fields[-1]}"
+    for field in reversed(fields[:-1]):
+        expr = {"$ifNull": [f"$payload.{field}", expr]}
+    return expr
+
+
+def _count_if(cond):
+    return {"$sum": {"$cond": [cond, 1, 0]}}
+
+
+def _to_amount(expr):
+    return {"$convert": {"input": expr, "to": "double", "onError": 0.0, "onNull": 0.0}}
+
+
+def _group_stats(event_types, fields):
+    """
+    Run one server-side $group over the matching events and return its
+    scalars — a handful of numbers over the wire instead of every document.
+    """
+    pipeline = [
+        {"$match": {"event_type": {"$in": event_types}}},
+        {"$group": {"_id": None, **fields}},
+    ]
+    result = list(db["events_raw"].aggregate(pipeline))
+    return result[0] if result else {}
+
 
 def run_quality_report():
     
     output_lines = []  
     
     def print_and_save(text=""):
-        """Print to console and save to list"""
-        print(text)
+        """Buffer a line; the whole report is written to stdout in one go"""
         output_lines.append(text)
     
     print_and_save("=" * 60)
@@ -23,9 +60,10 @@ def run_quality_report():
     PAYMENT_TYPES = ["historical_payment", "payment_attempt", "payment_confirmed"]
     REFUND_TYPES = ["historical_refund", "refund_created", "refund_processed"]
     
-    orders_df = normalize_orders(fetch_events(ORDER_TYPES))
-    payments_df = normalize_payments(fetch_events(PAYMENT_TYPES))
-    refunds_df = normalize_refunds(fetch_events(REFUND_TYPES))
+    orders_df = normalize_orders(fetch_normalized(
+        ORDER_TYPES, ORDER_FIELDS, extra=("event_id", "vendor", "event_type")))
+    payments_df = normalize_payments(fetch_normalized(PAYMENT_TYPES, PAYMENT_FIELDS))
+    refunds_df = normalize_refunds(fetch_normalized(REFUND_TYPES, REFUND_FIELDS))
     
     print_and_save(f"  Orders: {len(orders_df)} | Payments: {len(payments_df)} | Refunds: {len(refunds_df)}")
     print_and_save()
@@ -38,15 +76,43 @@ def run_quality_report():
         "total_refunds": len(refunds_df)
     }
     
-    # COMPLETENESS CHECKS
+    # COMPLETENESS CHECKS — computed server-side with $group so MongoDB
+    # returns a few scalars rather than shipping every raw document again
     print_and_save("1. DATA COMPLETENESS")
     print_and_save("-" * 60)
-    
-    report["orders_missing_customer_id"] = int(orders_df["customer_id"].isna().sum())
-    report["orders_missing_amount"] = int((orders_df["order_amount"] == 0).sum())
-    report["payments_missing_order_id"] = int(payments_df["order_id"].isna().sum())
-    report["refunds_missing_payment_id"] = int(refunds_df["payment_id"].isna().sum())
-    
+
+    status_lower = {"$toLower": {"$convert": {
+        "input": _payload_field("payment_status", "status", "state"),
+        "to": "string", "onError": "", "onNull": ""
+    }}}
+    is_success = {"$in": [status_lower, SUCCESS_STATUSES]}
+
+    order_stats = _group_stats(ORDER_TYPES, {
+        "missing_customer_id": _count_if({"$eq": [_payload_field("customerId"), None]}),
+        "zero_amount": _count_if({"$eq": [{"$ifNull": [_payload_field("totalAmount"), 0]}, 0]}),
+    })
+    payment_stats = _group_stats(PAYMENT_TYPES, {
+        "n": {"$sum": 1},
+        "missing_order_id": _count_if({"$eq": [_payload_field("order_id", "orderId"), None]}),
+        "n_success": _count_if(is_success),
+        "gross_revenue": {"$sum": {"$cond": [
+            is_success,
+            _to_amount(_payload_field("amountPaid", "amount", "payment_amount", "totalAmount")),
+            0.0
+        ]}},
+    })
+    refund_stats = _group_stats(REFUND_TYPES, {
+        "missing_payment_id": _count_if({"$eq": [_payload_field("payment_id", "paymentId", "transaction_id"), None]}),
+        "total_refunded": {"$sum": _to_amount(
+            _payload_field("amountRefunded", "amount", "refund_amount", "totalAmount")
+        )},
+    })
+
+    report["orders_missing_customer_id"] = int(order_stats.get("missing_customer_id", 0))
+    report["orders_missing_amount"] = int(order_stats.get("zero_amount", 0))
+    report["payments_missing_order_id"] = int(payment_stats.get("missing_order_id", 0))
+    report["refunds_missing_payment_id"] = int(refund_stats.get("missing_payment_id", 0))
+
     print_and_save(f"  Orders missing customer_id:    {report['orders_missing_customer_id']}")
     print_and_save(f"  Orders with zero amount:       {report['orders_missing_amount']}")
     print_and_save(f"  Payments missing order_id:     {report['payments_missing_order_id']}")
@@ -57,13 +123,24 @@ def run_quality_report():
     print_and_save("2. ORPHAN RECORDS")
     print_and_save("-" * 60)
     
+    # Membership tests run in Arrow's C++ kernels; drop NAs first so the
+    # value sets stay compact
+    order_id_set   = pa.array(orders_df["order_id"].dropna(), type=pa.string(), from_pandas=True)
+    payment_id_set = pa.array(payments_df["payment_id"].dropna(), type=pa.string(), from_pandas=True)
+
     # Payments with no matching order
-    orphan_payments = ~payments_df["order_id"].isin(orders_df["order_id"])
-    report["orphan_payments"] = int(orphan_payments.sum())
-    
+    orphan_payments = pc.invert(pc.is_in(
+        pa.array(payments_df["order_id"], type=pa.string(), from_pandas=True),
+        value_set=order_id_set
+    ))
+    report["orphan_payments"] = int(pc.sum(orphan_payments).as_py() or 0)
+
     # Refunds with no matching payment
-    orphan_refunds = ~refunds_df["payment_id"].isin(payments_df["payment_id"])
-    report["orphan_refunds"] = int(orphan_refunds.sum())
+    orphan_refunds = pc.invert(pc.is_in(
+        pa.array(refunds_df["payment_id"], type=pa.string(), from_pandas=True),
+        value_set=payment_id_set
+    ))
+    report["orphan_refunds"] = int(pc.sum(orphan_refunds).as_py() or 0)
     
     print_and_save(f"  Payments without matching order:  {report['orphan_payments']}")
     print_and_save(f"  Refunds without matching payment: {report['orphan_refunds']}")
@@ -81,13 +158,18 @@ def run_quality_report():
     )
     
     if not merged.empty:
-        merged["days_to_payment"] = (
-            (merged["payment_date"] - merged["created_at"]).dt.total_seconds() / 86400
-        )
-        
-        report["payments_over_7_days"] = int((merged["days_to_payment"] > 7).sum())
-        report["payments_over_30_days"] = int((merged["days_to_payment"] > 30).sum())
-        report["avg_days_to_payment"] = round(float(merged["days_to_payment"].mean()), 2)
+        # One ufunc over the raw datetime64 arrays — skips materializing a
+        # timedelta Series and a float-seconds Series. Dividing by a 1-day
+        # timedelta64 is resolution-safe (the arrays may be ns or us
+        # depending on the pandas version)
+        valid = merged["payment_date"].notna().values & merged["created_at"].notna().values
+        days = ((merged["payment_date"].values[valid]
+                 - merged["created_at"].values[valid])
+                / np.timedelta64(1, "D"))
+
+        report["payments_over_7_days"] = int((days > 7).sum())
+        report["payments_over_30_days"] = int((days > 30).sum())
+        report["avg_days_to_payment"] = round(float(days.mean()), 2) if days.size else 0
     else:
         report["payments_over_7_days"] = 0
         report["payments_over_30_days"] = 0
@@ -102,14 +184,13 @@ def run_quality_report():
     print_and_save("4. REVENUE INTEGRITY")
     print_and_save("-" * 60)
     
-    successful_payments = payments_df[payments_df["payment_status"] == "success"]
-    report["gross_revenue"] = round(float(successful_payments["payment_amount"].sum()), 2)
-    report["total_refunded"] = round(float(refunds_df["refund_amount"].sum()), 2)
+    report["gross_revenue"] = round(float(payment_stats.get("gross_revenue", 0.0)), 2)
+    report["total_refunded"] = round(float(refund_stats.get("total_refunded", 0.0)), 2)
     report["net_revenue"] = round(report["gross_revenue"] - report["total_refunded"], 2)
-    
+
     # Payment success rate
-    total_payments = len(payments_df)
-    successful_count = len(successful_payments)
+    total_payments = int(payment_stats.get("n", 0))
+    successful_count = int(payment_stats.get("n_success", 0))
     report["payment_success_rate"] = round(successful_count / total_payments, 4) if total_payments > 0 else 0
     
     # Refund rate
@@ -129,9 +210,11 @@ def run_quality_report():
     print_and_save("-" * 60)
     
     status_counts = payments_df["payment_status"].value_counts()
-    for status, count in status_counts.items():
-        pct = (count / len(payments_df)) * 100
-        print_and_save(f"  {status:15} {count:5} ({pct:5.1f}%)")
+    status_pcts   = status_counts.mul(100 / len(payments_df)) if len(payments_df) else status_counts
+    print_and_save("\n".join(
+        f"  {status:15} {count:5} ({pct:5.1f}%)"
+        for status, count, pct in zip(status_counts.index, status_counts.values, status_pcts.values)
+    ))
     print_and_save()
     
     #  VENDOR BREAKDOWN 
@@ -139,8 +222,10 @@ def run_quality_report():
     print_and_save("-" * 60)
     
     vendor_counts = orders_df["vendor"].value_counts()
-    for vendor, count in vendor_counts.items():
-        print_and_save(f"  {vendor:15} {count:5} orders")
+    print_and_save("\n".join(
+        f"  {vendor:15} {count:5} orders"
+        for vendor, count in zip(vendor_counts.index, vendor_counts.values)
+    ))
     print_and_save()
     
     #  SAVE REPORT 
@@ -161,7 +246,10 @@ def run_quality_report():
     print_and_save(f"✓ Report saved to {csv_path}")
     print_and_save(f"✓ Report saved to {txt_path}")
     print_and_save("=" * 60)
-    
+
+    # One stdout write for the whole report instead of a syscall per line
+    sys.stdout.write("\n".join(output_lines) + "\n")
+
     return report
 
 
@@ -1,6 +1,8 @@
 
 
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from pymongo import MongoClient
 from datetime import datetime, timezone
 from dotenv import load_dotenv
@@ -13,197 +15,296 @@ client = MongoClient(os.getenv("MONGO_URI"))
 db = client[os.getenv("MONGO_DB")]
 
 
-def fetch_events(event_types):
-    return list(db["events_raw"].find({"event_type": {"$in": event_types}}, {"_id": 0}))
+# Rows per intermediate frame — lets the GC free raw dicts between
+# chunks instead of holding every event until the full DataFrame exists
+CHUNK_ROWS = 50_000
 
 
-def normalize_orders(events):
-    if not events:
-        return pd.DataFrame()
-    
-    rows = []
+# Output column -> payload field aliases, in priority order. The server
+# coalesces these with $ifNull next to the data, so the wire carries one
+# already-flat value per column instead of the raw payload
+ORDER_FIELDS = {
+    "order_id":     ["order_id"],
+    "customer_id":  ["customerId"],
+    "order_amount": ["totalAmount"],
+    "order_status": ["state"],
+    "created_at":   ["created_at"],
+}
+
+PAYMENT_FIELDS = {
+    "payment_id":     ["transaction_id", "payment_id", "id", "paymentId"],
+    "order_id":       ["order_id", "orderId"],
+    "payment_amount": ["amountPaid", "amount", "payment_amount", "totalAmount"],
+    "payment_status": ["payment_status", "status", "state"],
+    "payment_method": ["channel", "method", "payment_method"],
+    "payment_date":   ["paid_at", "payment_date", "created_at"],
+}
+
+REFUND_FIELDS = {
+    "refund_id":     ["refund_id", "id", "transaction_id"],
+    "order_id":      ["order_id", "orderId"],
+    "payment_id":    ["payment_id", "paymentId", "transaction_id"],
+    "refund_amount": ["amountRefunded", "amount", "refund_amount", "totalAmount"],
+    "refund_reason": ["reason", "refund_reason"],
+    "refund_type":   ["type", "refund_type"],
+    "refund_date":   ["refunded_at", "refund_date", "created_at"],
+}
+
+
+def _ifnull_chain(aliases):
+    """Nested $ifNull over payload aliases, ending in an explicit null so
+    the projected field always exists in the output document."""
+    expr = None
+    for alias in reversed(aliases):
+        expr = {"$ifNull": [f"$payload.{alias}", expr]}
+    return expr
+
+
+def fetch_normalized(event_types, fields, extra=("event_id", "vendor")):
+    """
+    Stream events with payload aliases already coalesced server-side.
+    Returns flat documents in 5000-doc batches.
+    """
+    project = {"_id": 0}
+    project.update({name: 1 for name in extra})
+    project.update({out: _ifnull_chain(aliases) for out, aliases in fields.items()})
+    return db["events_raw"].aggregate(
+        [
+            {"$match": {"event_type": {"$in": event_types}}},
+            {"$project": project},
+        ],
+        allowDiskUse=True, batchSize=5000)
+
+
+def _flatten_events(events):
+    """json_normalize the cursor in ~CHUNK_ROWS batches and concat."""
+    frames = []
+    batch = []
     for event in events:
-        payload = event.get("payload", {})
-        
-        rows.append({
-            "order_id": payload.get("order_id"),
-            "customer_id": payload.get("customerId"),
-            "order_amount": float(payload.get("totalAmount", 0)),
-            "order_status": payload.get("state"),
-            "created_at": pd.to_datetime(payload.get("created_at"), utc=True, errors="coerce"),
-            "event_id": event.get("event_id"),
-            "vendor": event.get("vendor"),
-            "event_type": event.get("event_type")
-        })
-    
-    df = pd.DataFrame(rows)
-    df = df.sort_values("created_at", na_position="first").drop_duplicates(subset=["order_id"], keep="last")
+        batch.append(event)
+        if len(batch) >= CHUNK_ROWS:
+            frames.append(pd.json_normalize(batch, sep="."))
+            batch = []
+    if batch:
+        frames.append(pd.json_normalize(batch, sep="."))
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def normalize_orders(events):
+    df = _flatten_events(events)
+    if df.empty:
+        return df
+
+    # The server already coalesced aliases; only typing remains
+    # float32 is plenty for currency at this scale — half the bytes means
+    # half the bandwidth in the downstream groupbys and Parquet writes
+    df["order_amount"] = (pd.to_numeric(df["order_amount"], errors="coerce")
+                            .fillna(0.0).astype("float32"))
+    df["created_at"] = pd.to_datetime(df["created_at"], utc=True,
+                                      errors="coerce", format="mixed")
+
+    # Keep the latest record per order via a hash-group argmax — one O(N)
+    # pass instead of a full O(N log N) sort before dedup. NaT sorts as
+    # oldest (it lost to any real timestamp before too); dropna=False
+    # keeps the null-order_id rows the old dedup retained.
+    ts = df["created_at"].fillna(pd.Timestamp.min.tz_localize("UTC"))
+    df = df.loc[ts.groupby(df["order_id"], sort=False, dropna=False).idxmax()]
+
+    # Low-cardinality strings as categoricals: ~1-4 B/row instead of a
+    # PyObject per cell, and groupbys hash the integer codes
+    for col in ("vendor", "event_type"):
+        df[col] = df[col].astype("category")
+
+    # High-cardinality IDs as Arrow strings: contiguous storage and
+    # vectorized hashing in merges instead of one PyObject per cell
+    df = df.astype({"order_id": "string[pyarrow]",
+                    "customer_id": "string[pyarrow]",
+                    "event_id": "string[pyarrow]"})
     return df
 
 
+# Vendor status spellings collapsed to canonical values; anything not
+# listed passes through unchanged (matching the old if/elif chain)
+STATUS_MAP = {
+    "failed": "failed", "fail": "failed", "error": "failed",
+    "success": "success", "successful": "success",
+    "completed": "success", "paid": "success",
+}
+
+
 def normalize_payments(events):
-    if not events:
-        return pd.DataFrame()
-    
-    rows = []
-    for event in events:
-        payload = event.get("payload", {})
-        
-        payment_id = (payload.get("transaction_id") or 
-                     payload.get("payment_id") or 
-                     payload.get("id") or 
-                     payload.get("paymentId"))
-        
-        order_id = payload.get("order_id") or payload.get("orderId")
-        
-        amount = (payload.get("amountPaid") or 
-                 payload.get("amount") or 
-                 payload.get("payment_amount") or 
-                 payload.get("totalAmount"))
-        
-        status = payload.get("payment_status") or payload.get("status") or payload.get("state")
-        
-        if status:
-            status = status.lower()
-            if status in ["failed", "fail", "error"]:
-                status = "failed"
-            elif status in ["success", "successful", "completed", "paid"]:
-                status = "success"
-        
-        method = payload.get("channel") or payload.get("method") or payload.get("payment_method")
-        date = payload.get("paid_at") or payload.get("payment_date") or payload.get("created_at")
-        
-        rows.append({
-            "payment_id": payment_id,
-            "order_id": order_id,
-            "payment_amount": float(amount) if amount else 0.0,
-            "payment_status": status,
-            "payment_method": method,
-            "payment_date": pd.to_datetime(date, utc=True, errors="coerce"),
-            "event_id": event.get("event_id"),
-            "vendor": event.get("vendor")
-        })
-    
-    df = pd.DataFrame(rows)
+    df = _flatten_events(events)
+    if df.empty:
+        return df
+
+    df["payment_amount"] = (pd.to_numeric(df["payment_amount"], errors="coerce")
+                              .fillna(0.0).astype("float32"))
+
+    status = df["payment_status"].astype("string").str.lower()
+    df["payment_status"] = status.map(STATUS_MAP).fillna(status)
+
+    df["payment_date"] = pd.to_datetime(df["payment_date"], utc=True,
+                                        errors="coerce", format="mixed")
+
     df = df.drop_duplicates(subset=["payment_id"])
+    for col in ("vendor", "payment_status", "payment_method"):
+        df[col] = df[col].astype("category")
+
+    # int8 flag so the daily aggregate's paid_count is a plain numeric
+    # sum (cythonized groupby path) rather than a per-group compare
+    df["is_success"] = (df["payment_status"] == "success").astype("int8")
+
+    df = df.astype({"payment_id": "string[pyarrow]",
+                    "order_id": "string[pyarrow]",
+                    "event_id": "string[pyarrow]"})
     return df
 
 
 def normalize_refunds(events):
-    if not events:
-        return pd.DataFrame()
-    
-    rows = []
-    for event in events:
-        payload = event.get("payload", {})
-        
-        refund_id = payload.get("refund_id") or payload.get("id") or payload.get("transaction_id")
-        order_id = payload.get("order_id") or payload.get("orderId")
-        payment_id = payload.get("payment_id") or payload.get("paymentId") or payload.get("transaction_id")
-        
-        amount = (payload.get("amountRefunded") or 
-                 payload.get("amount") or 
-                 payload.get("refund_amount") or 
-                 payload.get("totalAmount"))
-        
-        reason = payload.get("reason") or payload.get("refund_reason")
-        refund_type = payload.get("type") or payload.get("refund_type")
-        date = payload.get("refunded_at") or payload.get("refund_date") or payload.get("created_at")
-        
-        rows.append({
-            "refund_id": refund_id,
-            "order_id": order_id,
-            "payment_id": payment_id,
-            "refund_amount": float(amount) if amount else 0.0,
-            "refund_reason": reason,
-            "refund_type": refund_type,
-            "refund_date": pd.to_datetime(date, utc=True, errors="coerce"),
-            "event_id": event.get("event_id"),
-            "vendor": event.get("vendor")
-        })
-    
-    df = pd.DataFrame(rows)
+    df = _flatten_events(events)
+    if df.empty:
+        return df
+
+    df["refund_amount"] = (pd.to_numeric(df["refund_amount"], errors="coerce")
+                             .fillna(0.0).astype("float32"))
+    df["refund_date"] = pd.to_datetime(df["refund_date"], utc=True,
+                                       errors="coerce", format="mixed")
+
     df = df.drop_duplicates(subset=["refund_id"])
+    for col in ("vendor", "refund_reason", "refund_type"):
+        df[col] = df[col].astype("category")
+
+    df = df.astype({"refund_id": "string[pyarrow]",
+                    "order_id": "string[pyarrow]",
+                    "payment_id": "string[pyarrow]",
+                    "event_id": "string[pyarrow]"})
     return df
 
 
+def _aggregate_daily_chunk(od, payments_df, refunds_df):
+    """
+    Aggregate one slice of orders. One hash-join tags each payment/refund
+    with its order's date and vendor (the join itself filters to the
+    slice), then one groupby reduces — instead of re-scanning the payment
+    and refund tables once per (date, vendor) group.
+    """
+    keys = ["order_date", "vendor"]
+
+    agg = (od.groupby(keys, observed=True, sort=False)
+             .agg(order_count=("order_id", "size")))
+
+    if not payments_df.empty:
+        pm = payments_df[["order_id", "payment_amount", "is_success"]].merge(
+            od, on="order_id", how="inner")
+        agg = agg.join(
+            pm.groupby(keys, observed=True, sort=False).agg(
+                gross_revenue=("payment_amount", "sum"),
+                paid_count=("is_success", "sum")),
+            how="left")
+    else:
+        agg["gross_revenue"] = 0.0
+        agg["paid_count"] = 0
+
+    if not refunds_df.empty:
+        rf = refunds_df[["order_id", "refund_amount"]].merge(
+            od, on="order_id", how="inner")
+        agg = agg.join(
+            rf.groupby(keys, observed=True, sort=False).agg(
+                total_refunds=("refund_amount", "sum")),
+            how="left")
+    else:
+        agg["total_refunds"] = 0.0
+
+    return agg
+
+
 def build_fact_order_daily(orders_df, payments_df, refunds_df):
     if orders_df.empty:
         return pd.DataFrame()
-    
-    results = []
-    orders_df["order_date"] = orders_df["created_at"].dt.date
-    
-    for (date, vendor), group in orders_df.groupby(["order_date", "vendor"]):
-        order_ids = group["order_id"].tolist()
-        
-        payments_subset = payments_df[payments_df["order_id"].isin(order_ids)]
-        gross_revenue = payments_subset["payment_amount"].sum()
-        paid_count = int((payments_subset["payment_status"] == "success").sum())
-        
-        refunds_subset = refunds_df[refunds_df["order_id"].isin(order_ids)]
-        total_refunds = refunds_subset["refund_amount"].sum()
-        
-        net_revenue = gross_revenue - total_refunds
-        order_count = len(order_ids)
-        
-        payment_success_rate = round(paid_count / order_count, 4) if order_count > 0 else None
-        refund_rate = round(total_refunds / gross_revenue, 4) if gross_revenue > 0 else None
-        
-        results.append({
-            "order_date": date,
-            "vendor": vendor,
-            "gross_revenue": float(gross_revenue),
-            "total_refunds": float(total_refunds),
-            "net_revenue": float(net_revenue),
-            "order_count": order_count,
-            "paid_count": paid_count,
-            "payment_success_rate": payment_success_rate,
-            "refund_rate": refund_rate
-        })
-    
-    return pd.DataFrame(results)
 
+    # floor('D') stays datetime64 — grouping hashes int64s instead of a
+    # column of boxed Python date objects
+    orders_df["order_date"] = orders_df["created_at"].dt.floor("D")
+    keys = ["order_date", "vendor"]
 
-def save_dataframes(orders_df, payments_df, refunds_df, daily_df):
-    """Save transformed DataFrames to CSV files"""
-    output_dir = Path("reports/transformed_data")
-    output_dir.mkdir(parents=True, exist_ok=True)
-    
-    print("\nSaving transformed data to CSV...")
-    
-    orders_df.to_csv(output_dir / "fact_orders.csv", index=False)
-    print(f"  ✓ fact_orders.csv saved ({len(orders_df)} rows)")
-    
-    payments_df.to_csv(output_dir / "fact_payments.csv", index=False)
-    print(f"  ✓ fact_payments.csv saved ({len(payments_df)} rows)")
-    
-    refunds_df.to_csv(output_dir / "fact_refunds.csv", index=False)
-    print(f"  ✓ fact_refunds.csv saved ({len(refunds_df)} rows)")
-    
-    daily_df.to_csv(output_dir / "fact_order_daily.csv", index=False)
-    print(f"  ✓ fact_order_daily.csv saved ({len(daily_df)} rows)")
-    
-    print(f"\nFiles saved to: {output_dir.absolute()}")
+    # Orders arrive nearly sorted by created_at from dedup; extending the
+    # sort to the group keys lets the groupby run-length over sorted keys
+    # instead of building a hash table
+    orders_df.sort_values(keys, kind="stable", inplace=True)
+
+    od = orders_df[["order_id", "order_date", "vendor"]]
+
+    # Bound the join working set to one month of orders at a time; each
+    # month's result is tiny (days x vendors), so the concat is cheap
+    month = od["order_date"].values.astype("datetime64[M]")
+    agg = pd.concat([
+        _aggregate_daily_chunk(od_chunk, payments_df, refunds_df)
+        for _, od_chunk in od.groupby(month, observed=True, sort=False)
+    ])
+
+    agg["gross_revenue"] = agg["gross_revenue"].fillna(0.0).astype("float32")
+    agg["total_refunds"] = agg["total_refunds"].fillna(0.0).astype("float32")
+    agg["order_count"] = agg["order_count"].astype("int32")
+    agg["paid_count"] = agg["paid_count"].fillna(0).astype("int32")
+
+    agg["net_revenue"] = agg["gross_revenue"] - agg["total_refunds"]
+
+    # One ufunc pass per rate; where= handles the zero denominators
+    agg["payment_success_rate"] = np.round(np.divide(
+        agg["paid_count"].to_numpy(dtype="float64"),
+        agg["order_count"].to_numpy(dtype="float64"),
+        out=np.full(len(agg), np.nan),
+        where=agg["order_count"].to_numpy() > 0), 4)
+    agg["refund_rate"] = np.round(np.divide(
+        agg["total_refunds"].to_numpy(),
+        agg["gross_revenue"].to_numpy(),
+        out=np.full(len(agg), np.nan),
+        where=agg["gross_revenue"].to_numpy() > 0), 4)
+
+    result = agg.reset_index()
+    # Back to plain dates only on the small aggregated frame
+    result["order_date"] = result["order_date"].dt.date
+
+    return result[[
+        "order_date", "vendor", "gross_revenue", "total_refunds",
+        "net_revenue", "order_count", "paid_count",
+        "payment_success_rate", "refund_rate"
+    ]]
 
 
 def run_transformation():
-    print("Fetching events from MongoDB...")
+    print("Fetching and normalizing events from MongoDB...")
+
+    # Idempotent: the $match on event_type walks this index instead of
+    # scanning the collection; payload.order_id is there for server-side
+    # joins by order
+    db["events_raw"].create_index(
+        [("event_type", 1), ("payload.order_id", 1)], background=True)
+
     ORDER_TYPES = ["historical_order", "order_created", "order_updated"]
     PAYMENT_TYPES = ["historical_payment", "payment_attempt", "payment_confirmed"]
     REFUND_TYPES = ["historical_refund", "refund_created", "refund_processed"]
 
-    raw_orders = fetch_events(ORDER_TYPES)
-    raw_payments = fetch_events(PAYMENT_TYPES)
-    raw_refunds = fetch_events(REFUND_TYPES)
+    # The three pipelines are independent; running each fetch+normalize in
+    # its own thread overlaps cursor network reads (pymongo releases the
+    # GIL on the socket) with pandas' C-level normalization work
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        orders_future = executor.submit(
+            lambda: normalize_orders(fetch_normalized(
+                ORDER_TYPES, ORDER_FIELDS, extra=("event_id", "vendor", "event_type"))))
+        payments_future = executor.submit(
+            lambda: normalize_payments(fetch_normalized(PAYMENT_TYPES, PAYMENT_FIELDS)))
+        refunds_future = executor.submit(
+            lambda: normalize_refunds(fetch_normalized(REFUND_TYPES, REFUND_FIELDS)))
+
+        orders_df = orders_future.result()
+        payments_df = payments_future.result()
+        refunds_df = refunds_future.result()
+
+    print(f"  Orders: {len(orders_df)} | Payments: {len(payments_df)} | Refunds: {len(refunds_df)}")
 
-    print(f"  Orders: {len(raw_orders)} | Payments: {len(raw_payments)} | Refunds: {len(raw_refunds)}")
-    print("\nNormalizing schemas...")
-    
-    orders_df = normalize_orders(raw_orders)
-    payments_df = normalize_payments(raw_payments)
-    refunds_df = normalize_refunds(raw_refunds)
-    
     print("\nBuilding daily aggregates...")
     daily_df = build_fact_order_daily(orders_df, payments_df, refunds_df)
 
@@ -221,30 +322,47 @@ def run_transformation():
     print(f"  Total refunds: ${daily_df['total_refunds'].sum():,.2f}")
     print(f"  Total net revenue: ${daily_df['net_revenue'].sum():,.2f}")
     
-    # Save to CSV files
+    # Save fact tables to the warehouse folder
     save_dataframes(orders_df, payments_df, refunds_df, daily_df)
 
     return orders_df, payments_df, refunds_df, daily_df
 
 # save transformed dataframes to warehouse folder
-def save_dataframes(orders_df, payments_df, refunds_df, daily_df):
+def save_dataframes(orders_df, payments_df, refunds_df, daily_df, write_csv=False):
+    """
+    Write fact tables as Snappy Parquet — columnar, dictionary-encoded,
+    no per-float text formatting. Pass write_csv=True for human-readable
+    copies alongside.
+    """
     warehouse_dir = Path("warehouse/facts")
     warehouse_dir.mkdir(parents=True, exist_ok=True)
-    
+
     print("\nSaving fact tables to warehouse...")
-    
-    orders_df.to_csv(warehouse_dir / "fact_orders.csv", index=False)
-    print(f"  ✓ fact_orders.csv ({len(orders_df)} rows)")
-    
-    payments_df.to_csv(warehouse_dir / "fact_payments.csv", index=False)
-    print(f"  ✓ fact_payments.csv ({len(payments_df)} rows)")
-    
-    refunds_df.to_csv(warehouse_dir / "fact_refunds.csv", index=False)
-    print(f"  ✓ fact_refunds.csv ({len(refunds_df)} rows)")
-    
-    daily_df.to_csv(warehouse_dir / "fact_order_daily.csv", index=False)
-    print(f"  ✓ fact_order_daily.csv ({len(daily_df)} rows)")
-    
+
+    tables = [
+        ("fact_orders", orders_df),
+        ("fact_payments", payments_df),
+        ("fact_refunds", refunds_df),
+        ("fact_order_daily", daily_df),
+    ]
+    # The four writes are independent and pandas releases the GIL in the
+    # Parquet C++ path, so they overlap in a small thread pool
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            (name, df, executor.submit(
+                df.to_parquet, warehouse_dir / f"{name}.parquet",
+                engine="pyarrow", compression="snappy", index=False))
+            for name, df in tables
+        ]
+        for name, df, future in futures:
+            future.result()
+            print(f"  ✓ {name}.parquet ({len(df)} rows)")
+
+    if write_csv:
+        for name, df in tables:
+            df.to_csv(warehouse_dir / f"{name}.csv", index=False)
+            print(f"  ✓ {name}.csv ({len(df)} rows)")
+
     print(f"\nFact tables saved to: {warehouse_dir.absolute()}")
 
 